@@ -23,6 +23,16 @@ Parse XML into Atomic nodes for easy styling
   node = atomicml.XmlParser().parse(open('data.xml'))
   print(node)
 
+Parse large XML faster with expat directly (same tree shape)
+  import atomicml
+  node = atomicml.ExpatParser().parse(open('data.xml', 'rb'))
+  print(node)
+
+Write Atomic nodes back to XML
+  import atomicml
+  with open('data.xml', 'w', encoding='utf-8') as fp:
+      atomicml.write_xml(atomicml.parse_node(open('data.at')), fp)
+
 ////////////////
 AtomicStyle
 
@@ -36,18 +46,86 @@ Implement your dispatching subclass.
       self.setMap('*', 'li')
       self.setMap('.', 'text')
     def g_book(self, node, args):
-      print(node.data)
+      print(node.value)
       self.style(children)
     def g_li(self, node, args):
-      print(node.data)
+      print(node.value)
       self.style(children)
     def g_text(self, node, args):
-      print(node.data)
+      print(node.value)
   MyStyle().style(parse_nodes(open('data.at')))
 
+Cache the output of pure handlers that return their result.
+style() returns the non-None handler results for its children.
+FrozenNode trees are styled without the cache.
+
+  class MyCachedStyle(atomicml.AtomicStyle):
+    def __init__(self):
+      super().__init__()
+      self.cache = atomicml.StyleCache(maxsize=1024, path='style.cache')
+    @atomicml.memoize
+    def f_book(self, node):
+      return ''.join(self.style(node.children))
+
+////////////////
+JSON
+
+Stream nodes as one JSON line each, nested or flat preorder
+  import atomicml
+  with open('data.ndjson', 'w') as fp:
+      atomicml.to_ndjson(open('data.at'), fp, flat=True)
+  for node in atomicml.from_ndjson(open('data.ndjson')):
+      print(node)
+
+////////////////
+FrozenNode
+
+Share untouched subtrees between versions of a tree
+  import atomicml
+  def rename(node):
+      return node.with_data(f'li {node.value}') if node.name == '*' else node
+  tree = atomicml.freeze(atomicml.parse_nodes(open('data.at'))[0])
+  print(atomicml.thaw(atomicml.transform(tree, rename)))
+
+////////////////
+Schema
+
+Validate nodes against a schema written in AtomicML. Cardinality is
+1 (default), ?, * or +. Undeclared elements are not checked.
+
+  import atomicml
+  schema = atomicml.Schema('''
+  root book
+  element book
+    attr title
+    attr lang ?
+    child chapter +
+  element chapter
+    child . *
+  ''')
+  for lineno, message in schema.validate(atomicml.parse_nodes(open('data.at'))):
+      print(lineno, message)
+
+////////////////
+Diff and Patch
+
+Ship an AtomicML edit script instead of the whole document.
+
+  import atomicml
+  script = atomicml.diff(atomicml.parse_nodes(old), atomicml.parse_nodes(new))
+  wire = str(script)
+  atomicml.patch(nodes, atomicml.parse_nodes(wire))
+
 """
+import collections
+import hashlib
 import io
+import json
+import marshal
 import re
+import shelve
+import sys
+import xml.parsers.expat
 import xml.sax
 import xml.sax.handler
 
@@ -55,14 +133,42 @@ import xml.sax.handler
 
 
 class Node:
-    """Encapsulate data and children of a tree node"""
+    """Encapsulate data and children of a tree node
+
+    name is the interned first token of data, value is the remainder;
+    both follow assignments to data.
+    """
+
+    __slots__ = ("_data", "name", "blanks", "lineno", "children")
 
     def __init__(self, data="", blanks=0, lineno=0):
-        self.data = data
+        self._data = data
+        fields = data.split(None, 1)
+        self.name = sys.intern(fields[0]) if fields else ""
         self.blanks = blanks
         self.lineno = lineno
         self.children = []
 
+    @property
+    def data(self):
+        """Text of the node; assigning it updates name"""
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        fields = data.split(None, 1)
+        self.name = sys.intern(fields[0]) if fields else ""
+
+    @property
+    def value(self):
+        """Remainder of data after name"""
+        name = self.name
+        if not name:
+            return ""
+        data = self._data
+        return data[data.index(name) + len(name) :].lstrip()
+
     indent = "  "
 
     def __str__(self, indent=""):
@@ -139,7 +245,7 @@ def parse_node(source):
             stack.pop()
         elif isinstance(token, SameDent):
             if len(stack) == 2:
-                yield stack[0].children[-1]
+                yield stack[0].children.pop()
             node = Node(token.data, blanks, token.lineno)
             blanks = 0
             stack[-2].children.append(node)
@@ -153,32 +259,538 @@ def parse_nodes(source):
     """Parse the entire AtomicML file into nodes"""
     return [node for node in parse_node(source)]
 
+# ////////////////////////////////////////////////////////////////
+# FrozenNode
+
+
+class FrozenNode(
+    collections.namedtuple("FrozenNode", "data name blanks lineno children")
+):
+    """Immutable node whose children tuple is shared between versions
+
+    name is derived from data; _make and _replace recompute it.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, data="", blanks=0, lineno=0, children=()):
+        fields = data.split(None, 1)
+        name = sys.intern(fields[0]) if fields else ""
+        return super().__new__(cls, data, name, blanks, lineno, tuple(children))
+
+    def __getnewargs__(self):
+        return self.data, self.blanks, self.lineno, self.children
+
+    @classmethod
+    def _make(cls, iterable):
+        data, _, blanks, lineno, children = iterable
+        return cls(data, blanks, lineno, children)
+
+    def _replace(self, **kwargs):
+        fields = {"data", "blanks", "lineno", "children"}
+        if not fields.issuperset(kwargs):
+            raise ValueError(f"cannot replace {sorted(set(kwargs) - fields)}")
+        return FrozenNode(
+            kwargs.get("data", self.data),
+            kwargs.get("blanks", self.blanks),
+            kwargs.get("lineno", self.lineno),
+            kwargs.get("children", self.children),
+        )
+
+    @property
+    def value(self):
+        """Remainder of data after name"""
+        if not self.name:
+            return ""
+        return self.data[self.data.index(self.name) + len(self.name) :].lstrip()
+
+    indent = Node.indent
+    __str__ = Node.__str__
+
+    def with_data(self, data):
+        """Return a copy with new data sharing the same children"""
+        return FrozenNode(data, self.blanks, self.lineno, self.children)
+
+    def with_children(self, children):
+        """Return a copy with new children"""
+        return FrozenNode(self.data, self.blanks, self.lineno, children)
+
+    def replace(self, path, node):
+        """Return a copy with the node at path replaced, or removed if None
+
+        path is a sequence of child indices. Only its ancestors are rebuilt.
+        """
+        ancestors = [self]
+        for index in path[:-1]:
+            ancestors.append(ancestors[-1].children[index])
+        for index in reversed(path):
+            parent = ancestors.pop()
+            head, tail = parent.children[:index], parent.children[index + 1 :]
+            middle = () if node is None else (node,)
+            node = parent.with_children(head + middle + tail)
+        return node
+
+
+def freeze(node):
+    """Convert a Node tree to a FrozenNode tree"""
+    stack = [(node, False)]
+    results = []
+    while stack:
+        node, visited = stack.pop()
+        if not visited:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+            continue
+        count = len(node.children)
+        children = results[len(results) - count :]
+        del results[len(results) - count :]
+        results.append(FrozenNode(node.data, node.blanks, node.lineno, children))
+    return results[0]
+
+
+def thaw(node):
+    """Copy a FrozenNode or Node tree to a new Node tree"""
+    root = Node(node.data, node.blanks, node.lineno)
+    stack = [(root, node.children)]
+    while stack:
+        parent, children = stack.pop()
+        for child in children:
+            thawed = Node(child.data, child.blanks, child.lineno)
+            parent.children.append(thawed)
+            stack.append((thawed, child.children))
+    return root
+
+
+def transform(node, func):
+    """Apply func bottom-up to a FrozenNode tree and return the new root
+
+    func receives each node after its children are transformed and
+    returns it unchanged, a replacement, or None to prune it. A node is
+    rebuilt only when one of its children changed, so untouched subtrees
+    are shared with the original tree.
+    """
+    stack = [(node, False)]
+    results = []
+    while stack:
+        node, visited = stack.pop()
+        if not visited:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+            continue
+        count = len(node.children)
+        if count:
+            children = results[len(results) - count :]
+            del results[len(results) - count :]
+            if any(new is not old for new, old in zip(children, node.children)):
+                kept = [child for child in children if child is not None]
+                node = node.with_children(kept)
+        results.append(func(node))
+    return results[0]
+
+
 # ////////////////////////////////////////////////////////////////
 # AtomicStyle
 
 
+def subtree_digest(node, digests=None):
+    """Hash data and children bottom-up and return the digest of node
+
+    Digests are kept in digests by id(node); nodes already there are not
+    hashed again, so only share the dict while the tree is unchanged.
+    One preorder walk lists the nodes; read in reverse it is a postorder
+    in which the digests of a node's children are the last on a stack.
+    """
+    digests = {} if digests is None else digests
+    if id(node) in digests:
+        return digests[id(node)]
+    order, stack = [], [node]
+    visit, pop, push = order.append, stack.pop, stack.extend
+    while stack:
+        top = pop()
+        visit(top)
+        if id(top) not in digests:
+            push(top.children)
+    results = []
+    base = hashlib.blake2b(digest_size=16)
+    for top in reversed(order):
+        digest = digests.get(id(top))
+        if digest is None:
+            data = top.data.encode()
+            hasher = base.copy()
+            hasher.update(len(data).to_bytes(8, "little"))
+            hasher.update(data)
+            count = len(top.children)
+            if count:
+                for child in results[-count:]:
+                    hasher.update(child)
+                del results[-count:]
+            digest = digests[id(top)] = hasher.digest()
+        results.append(digest)
+    return results[0]
+
+
+def memoize(handler):
+    """Mark a pure, output-returning style handler as cacheable"""
+    handler.memoize = True
+    return handler
+
+
+class StyleCache:
+    """Bounded LRU of handler output with an optional shelve tier on disk"""
+
+    missing = object()
+
+    def __init__(self, maxsize=4096, path=None):
+        self.maxsize = maxsize
+        self.memory = collections.OrderedDict()
+        self.disk = shelve.open(path) if path else None
+
+    def get(self, key, default=None):
+        """Return cached output for key, promoting disk hits to memory"""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if self.disk is not None and key in self.disk:
+            value = self.disk[key]
+            self.remember(key, value)
+            return value
+        return default
+
+    def put(self, key, value):
+        """Cache output for key in memory and on disk"""
+        self.remember(key, value)
+        if self.disk is not None:
+            self.disk[key] = value
+
+    def remember(self, key, value):
+        """Cache output for key in memory, evicting the least recently used"""
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def close(self):
+        """Flush and close the disk tier"""
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+
 class AtomicStyle:
     """Recur through the node tree, match node names, call handlers"""
 
     def __init__(self):
         self.map = {}
         self.pre = "f_"
+        self.cache = None
+        self.fingerprints = {}
+        self.digests = None
 
     def style(self, children, **kwargs):
-        """Recur through children and style"""
-        children = children if isinstance(children, list) else [children]
+        """Recur through children and style, return handler results
+
+        Subtree digests for the cache are computed once per top-level call.
+        """
+        if self.digests is not None:
+            return self.style_children(children, kwargs)
+        self.digests = {}
+        try:
+            return self.style_children(children, kwargs)
+        finally:
+            self.digests = None
+
+    def style_children(self, children, kwargs):
+        """Dispatch each child to its handler and collect the results"""
+        children = [children] if isinstance(children, (Node, FrozenNode)) else children
+        results = []
         for node in children:
-            name = node.data.split(None, 1)[0]
-            style = getattr(self, f"{self.pre}{self.map.get(name, name)}", None)
-            if style:
-                style(node, **kwargs)
+            name = node.name
+            handler = f"{self.pre}{self.map.get(name, name)}"
+            style = getattr(self, handler, None)
+            if not style:
+                results.extend(self.style(node.children, **kwargs))
+                continue
+            if (
+                self.cache is not None
+                and getattr(style, "memoize", False)
+                and isinstance(node, Node)
+            ):
+                result = self.memoized(style, handler, node, kwargs)
             else:
-                self.style(node.children, **kwargs)
+                result = style(node, **kwargs)
+            if result is not None:
+                results.append(result)
+        return results
+
+    def memoized(self, style, handler, node, kwargs):
+        """Return cached output of style for an identical subtree"""
+        key = hashlib.blake2b(digest_size=16)
+        key.update(subtree_digest(node, self.digests))
+        key.update(self.fingerprint())
+        key.update(handler.encode())
+        key.update(repr(sorted(kwargs.items())).encode())
+        key = key.hexdigest()
+        result = self.cache.get(key, StyleCache.missing)
+        if result is StyleCache.missing:
+            result = style(node, **kwargs)
+            self.cache.put(key, result)
+        return result
+
+    def fingerprint(self):
+        """Hash the class, pre, map and handler code that output depends on"""
+        config = repr((self.__class__.__qualname__, self.pre, sorted(self.map.items())))
+        fingerprint = self.fingerprints.get(config)
+        if fingerprint is None:
+            digest = hashlib.blake2b(config.encode(), digest_size=16)
+            for name in sorted(dir(self.__class__)):
+                code = getattr(getattr(self.__class__, name), "__code__", None)
+                if name.startswith(self.pre) and code is not None:
+                    digest.update(name.encode())
+                    digest.update(marshal.dumps(code))
+            fingerprint = self.fingerprints[config] = digest.digest()
+        return fingerprint
+
+
+# ////////////////////////////////////////////////////////////////
+# Schema
+
+
+class Schema(AtomicStyle):
+    """Compile an AtomicML schema into tables and validate nodes"""
+
+    cardinality = {"1": (1, 1), "?": (0, 1), "*": (0, None), "+": (1, None)}
+
+    def __init__(self, source):
+        super().__init__()
+        self.roots = set()
+        self.elements = {}
+        for node in parse_nodes(source):
+            if node.data and node.name not in ("root", "element"):
+                self.error(node)
+            self.style(node)
+
+    def error(self, node):
+        """Raise ValueError naming the line of a malformed entry"""
+        raise ValueError(f"line {node.lineno}: bad schema entry {node.data!r}")
+
+    def f_root(self, node):
+        """Add the names of allowed root elements"""
+        if node.children:
+            self.error(node.children[0])
+        self.roots.update(node.value.split())
+
+    def f_element(self, node):
+        """Compile the child and attr entries of one element into a rule"""
+        if not node.value:
+            self.error(node)
+        rule = self.elements[node.value] = {}
+        for child in node.children:
+            fields = child.value.split()
+            if child.name not in ("child", "attr") or not 1 <= len(fields) <= 2:
+                self.error(child)
+            if child.children:
+                self.error(child.children[0])
+            card = fields[1] if len(fields) > 1 else "1"
+            if card not in self.cardinality:
+                self.error(child)
+            name = f"@{fields[0]}" if child.name == "attr" else fields[0]
+            rule[sys.intern(name)] = self.cardinality[card]
+
+    def validate(self, nodes):
+        """Return (lineno, message) for each error in one iterative pass
+
+        The children of an !xml node from XmlParser or ExpatParser are
+        checked as roots, skipping !notation and !entity. The empty node
+        parse_node yields for an empty document is skipped.
+        """
+        roots = []
+        for node in iter_nodes(nodes):
+            if node.name == "!xml":
+                roots.extend(
+                    child for child in node.children if not child.name.startswith("!")
+                )
+            elif node.data or node.children:
+                roots.append(node)
+        errors = []
+        if self.roots:
+            for node in roots:
+                if node.name not in self.roots:
+                    errors.append((node.lineno, f"unexpected root {node.name}"))
+        stack = roots[::-1]
+        while stack:
+            node = stack.pop()
+            rule = self.elements.get(node.name)
+            if rule is not None:
+                counts = collections.Counter()
+                for child in node.children:
+                    counts[child.name] += 1
+                    if child.name not in rule:
+                        errors.append(
+                            (child.lineno, f"unexpected {child.name} in {node.name}")
+                        )
+                for name, (low, high) in rule.items():
+                    count = counts[name]
+                    if count < low:
+                        errors.append((node.lineno, f"{node.name} missing {name}"))
+                    elif high is not None and count > high:
+                        errors.append((node.lineno, f"{node.name} has {count} {name}"))
+            stack.extend(node.children[::-1])
+        return errors
+
+    def parse_node(self, source, errors):
+        """Iterate over parsed nodes, validating each and extending errors"""
+        for node in parse_node(source):
+            errors.extend(self.validate(node))
+            yield node
+
+
+# ////////////////////////////////////////////////////////////////
+# Diff and Patch
+
+
+def tree_root(tree):
+    """Wrap a list of nodes in an unnamed root node"""
+    if not isinstance(tree, list):
+        return tree
+    root = Node()
+    root.children = tree
+    return root
+
+
+def next_index(positions, digest, start):
+    """Return the first index at or after start with digest, or None"""
+    indexes = positions.get(digest)
+    while indexes and indexes[0] < start:
+        indexes.popleft()
+    return indexes[0] if indexes else None
+
+
+def align(old, new, digests):
+    """Yield (action, old index, new index) to turn old children into new
+
+    Equal digests match. Otherwise the nearer next match chooses between
+    insert and delete, and children with no later match pair up.
+    """
+    old_positions = collections.defaultdict(collections.deque)
+    new_positions = collections.defaultdict(collections.deque)
+    for index, node in enumerate(old):
+        old_positions[digests[id(node)]].append(index)
+    for index, node in enumerate(new):
+        new_positions[digests[id(node)]].append(index)
+    old_index = new_index = 0
+    while old_index < len(old) and new_index < len(new):
+        old_digest = digests[id(old[old_index])]
+        new_digest = digests[id(new[new_index])]
+        if old_digest == new_digest:
+            yield "match", old_index, new_index
+            old_index += 1
+            new_index += 1
+            continue
+        inserted = next_index(new_positions, old_digest, new_index)
+        deleted = next_index(old_positions, new_digest, old_index)
+        if inserted is not None and (
+            deleted is None or inserted - new_index <= deleted - old_index
+        ):
+            yield "insert", old_index, new_index
+            new_index += 1
+        elif deleted is not None:
+            yield "delete", old_index, new_index
+            old_index += 1
+        else:
+            yield "pair", old_index, new_index
+            old_index += 1
+            new_index += 1
+    for old_index in range(old_index, len(old)):
+        yield "delete", old_index, new_index
+    for new_index in range(new_index, len(new)):
+        yield "insert", old_index, new_index
+
+
+def diff(old, new):
+    """Return an !diff node of update, delete, insert ops keyed by path
+
+    Paths are dotted child indices from the root, or from the list of
+    top-level nodes. Subtrees with equal digests are skipped; digests
+    are computed for each call, not cached on the trees, so every call
+    hashes both trees in full, about as long as parsing them. An update
+    to empty data has no child. Blank lines and line numbers are not
+    compared.
+    """
+    script = Node("!diff")
+    old, new = tree_root(old), tree_root(new)
+    digests = {}
+    subtree_digest(old, digests)
+    subtree_digest(new, digests)
+    stack = [(old, new, "")]
+    while stack:
+        old, new, path = stack.pop()
+        if digests[id(old)] == digests[id(new)]:
+            continue
+        if old.data != new.data:
+            op = Node(f"update {path}".rstrip())
+            if new.data:
+                op.children.append(Node(new.data))
+            script.children.append(op)
+        prefix = f"{path}." if path else ""
+        pairs = []
+        old_children, new_children = old.children, new.children
+        for action, old_index, new_index in align(old_children, new_children, digests):
+            if action == "pair":
+                pair = old_children[old_index], new_children[new_index]
+                pairs.append((*pair, f"{prefix}{new_index}"))
+            elif action == "delete":
+                script.children.append(Node(f"delete {prefix}{new_index}"))
+            elif action == "insert":
+                op = Node(f"insert {prefix}{new_index}")
+                op.children.append(new_children[new_index])
+                script.children.append(op)
+        stack.extend(reversed(pairs))
+    return script
+
+
+def patch(tree, script):
+    """Apply an !diff script from diff to tree in place and return tree
+
+    Inserted subtrees are copied from the script. An update without a
+    child sets empty data.
+    """
+    script = script[0] if isinstance(script, list) else script
+    root = tree_root(tree)
+    for op in script.children:
+        path = [int(index) for index in op.value.split(".")] if op.value else []
+        parent = root
+        for index in path[:-1]:
+            parent = parent.children[index]
+        if op.name == "update":
+            node = parent.children[path[-1]] if path else parent
+            node.data = op.children[0].data if op.children else ""
+        elif op.name == "delete":
+            del parent.children[path[-1]]
+        elif op.name == "insert":
+            parent.children.insert(path[-1], thaw(op.children[0]))
+    return tree
 
 
 # ////////////////////////////////////////////////////////////////
 # XML Parser
 
+XML_ESCAPE = str.maketrans({"\\": r"\\", "\n": r"\n"})
+XML_UNESCAPE = re.compile(r"\\([\\n])")
+XML_NAME = re.compile(r"[^\W\d][\w.:-]*\Z")
+XML_CHAR = re.compile(r"[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]")
+XML_TEXT = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", "\r": "&#13;"})
+XML_ATTR = str.maketrans(
+    {
+        "&": "&amp;",
+        "<": "&lt;",
+        ">": "&gt;",
+        '"': "&quot;",
+        "\n": "&#10;",
+        "\r": "&#13;",
+        "\t": "&#9;",
+    }
+)
+
 
 class XmlParser(xml.sax.ContentHandler, xml.sax.handler.DTDHandler):
     """XmlParser creates Atomic nodes from XML files"""
@@ -201,7 +813,7 @@ class XmlParser(xml.sax.ContentHandler, xml.sax.handler.DTDHandler):
 
     def filter(self, data):
         """Escape newlines and escapes"""
-        return data.replace("\n", r"\n").replace("\\", r"\\")
+        return data.translate(XML_ESCAPE)
 
     def startElement(self, name, attrs):
         node = Node(name)
@@ -236,3 +848,327 @@ class XmlParser(xml.sax.ContentHandler, xml.sax.handler.DTDHandler):
         if ndata:
             node.children.append(Node(f"@ndata {ndata}"))
         self.node_stack[-1].children.append(node)
+
+
+class ExpatParser:
+    """ExpatParser creates the same Atomic nodes as XmlParser using expat"""
+
+    buffer_size = 1 << 16
+
+    def __init__(self):
+        self.node_stack = []
+        self.text = []
+
+    def parse(self, source):
+        """Parse XML into Atomic Nodes"""
+        root = Node("!xml")
+        self.node_stack = [root]
+        self.text = []
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        parser.buffer_size = self.buffer_size
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.text.append
+        parser.NotationDeclHandler = self.notation_decl
+        parser.UnparsedEntityDeclHandler = self.unparsed_entity_decl
+        if isinstance(source, (str, bytes)):
+            parser.Parse(source, True)
+        else:
+            while True:
+                data = source.read(self.buffer_size)
+                parser.Parse(data, not data)
+                if not data:
+                    break
+        self.flush()
+        return root
+
+    def flush(self):
+        """Append buffered character data as a single text node"""
+        if self.text:
+            content = "".join(self.text).strip()
+            self.text.clear()
+            if content:
+                node = Node(f". {content.translate(XML_ESCAPE)}")
+                self.node_stack[-1].children.append(node)
+
+    def start_element(self, name, attrs):
+        """Open an element node with sorted @attr children"""
+        if self.text:
+            self.flush()
+        node = Node(name)
+        for att in sorted(attrs):
+            node.children.append(Node(f"@{att} {attrs[att].translate(XML_ESCAPE)}"))
+        self.node_stack[-1].children.append(node)
+        self.node_stack.append(node)
+
+    def end_element(self, _name):
+        """Close the current element node"""
+        if self.text:
+            self.flush()
+        self.node_stack.pop()
+
+    def notation_decl(self, name, _base, system_id, public_id):
+        """Append a !notation node"""
+        node = Node(f"!notation {name}")
+        if public_id:
+            node.children.append(Node(f"@public {public_id.translate(XML_ESCAPE)}"))
+        if system_id:
+            node.children.append(Node(f"@system {system_id.translate(XML_ESCAPE)}"))
+        self.node_stack[-1].children.append(node)
+
+    def unparsed_entity_decl(self, name, _base, system_id, public_id, ndata):
+        """Append an !entity node"""
+        node = Node(f"!entity {name}")
+        if public_id:
+            node.children.append(Node(f"@public {public_id.translate(XML_ESCAPE)}"))
+        if system_id:
+            node.children.append(Node(f"@system {system_id.translate(XML_ESCAPE)}"))
+        if ndata:
+            node.children.append(Node(f"@ndata {ndata}"))
+        self.node_stack[-1].children.append(node)
+
+
+def iter_nodes(source):
+    """Return an iterable of nodes from a node, list or node iterator"""
+    return [source] if isinstance(source, (Node, FrozenNode)) else source
+
+
+def unescape(data):
+    """Undo the newline and escape escaping of XmlParser"""
+    if "\\" not in data:
+        return data
+    return XML_UNESCAPE.sub(lambda match: "\n" if match[1] == "n" else "\\", data)
+
+
+def xml_name(name, lineno=0):
+    """Return name if it is a well-formed XML name, else raise ValueError"""
+    if not XML_NAME.match(name):
+        raise ValueError(f"line {lineno}: invalid XML name {name!r}")
+    return name
+
+
+def xml_chars(text, lineno=0):
+    """Return text if every character is allowed in XML, else raise ValueError"""
+    match = XML_CHAR.search(text)
+    if match:
+        raise ValueError(f"line {lineno}: invalid XML character {match.group()!r}")
+    return text
+
+
+def xml_literal(text, lineno=0):
+    """Quote a public or system ID with whichever quote it does not contain"""
+    xml_chars(text, lineno)
+    if '"' not in text:
+        return f'"{text}"'
+    if "'" not in text:
+        return f"'{text}'"
+    raise ValueError(f"line {lineno}: ID contains both quotes {text!r}")
+
+
+def xml_doctype(node, root=None):
+    """Return a DOCTYPE for the !notation and !entity children of !xml"""
+    decls = []
+    if root is None:
+        root = "xml"
+        for child in node.children:
+            if not child.name.startswith("!"):
+                root = child.name
+                break
+    for child in node.children:
+        if child.name not in ("!notation", "!entity"):
+            continue
+        ids = {item.name: unescape(item.value) for item in child.children}
+        if "@public" in ids:
+            if '"' in ids["@public"]:
+                raise ValueError(f"line {child.lineno}: public ID contains '\"'")
+            external = f"PUBLIC {xml_literal(ids['@public'], child.lineno)}"
+            if "@system" in ids:
+                external += f" {xml_literal(ids['@system'], child.lineno)}"
+        else:
+            external = f"SYSTEM {xml_literal(ids.get('@system', ''), child.lineno)}"
+        if "@ndata" in ids:
+            external += f" NDATA {xml_name(ids['@ndata'], child.lineno)}"
+        name = xml_name(child.value, child.lineno)
+        decls.append(f"<{child.name.upper()} {name} {external}>")
+    if not decls:
+        return ""
+    return f"<!DOCTYPE {xml_name(root, node.lineno)} [{''.join(decls)}]>\n"
+
+
+def xml_start(node, out):
+    """Append the start tag of node without its close, return its content"""
+    out.append(f"<{xml_name(node.name, node.lineno)}")
+    content = []
+    attrs = set()
+    for child in node.children:
+        if not child.name.startswith("@"):
+            content.append(child)
+            continue
+        name = xml_name(child.name[1:], child.lineno)
+        if name in attrs:
+            raise ValueError(f"line {child.lineno}: duplicate {child.name}")
+        attrs.add(name)
+        value = xml_chars(unescape(child.value), child.lineno)
+        out.append(f' {name}="{value.translate(XML_ATTR)}"')
+    return content
+
+
+def write_xml(source, fp, declaration=True, root=None, buffer_size=1024):
+    """Write Atomic nodes as well-formed XML to fp in one iterative pass
+
+    !xml nodes contribute their children and a DOCTYPE, @attr children
+    become attributes, . nodes become text, other ! nodes are skipped.
+    The value of an element node is written as its leading text, and
+    adjacent texts are separated by a newline. Element and attribute
+    names and characters are checked. More than one top-level element, or top-level
+    text, raises ValueError unless root names a wrapper element.
+    """
+    out = ['<?xml version="1.0"?>\n'] if declaration else []
+    opened = root is None
+    depth = 0 if opened else 1
+    roots = 0
+    text = False
+    stack = [(iter(iter_nodes(source)), "")]
+    while stack:
+        node = next(stack[-1][0], None)
+        if node is None:
+            close = stack.pop()[1]
+            if close:
+                out.append(close)
+                depth -= 1
+                text = False
+        elif node.name == "!xml":
+            doctype = xml_doctype(node, root)
+            if doctype and (roots or opened and root is not None):
+                raise ValueError(f"line {node.lineno}: DOCTYPE after root element")
+            out.append(doctype)
+            stack.append((iter(node.children), ""))
+        elif node.name.startswith(("!", "@")) or not node.name:
+            continue
+        elif not opened:
+            out.append(f"<{xml_name(root)}>")
+            opened = True
+            stack.append((iter([node]), ""))
+        elif node.name == ".":
+            data = xml_chars(unescape(node.value), node.lineno)
+            if data and not depth:
+                raise ValueError(f"line {node.lineno}: text outside root element")
+            if data:
+                out.append("\n" if text else "")
+                out.append(data.translate(XML_TEXT))
+                text = True
+            stack.append((iter(node.children), ""))
+        else:
+            if not depth:
+                roots += 1
+                if roots > 1:
+                    raise ValueError(f"line {node.lineno}: second root {node.name}")
+            content = xml_start(node, out)
+            if content or node.value:
+                value = xml_chars(unescape(node.value), node.lineno)
+                out.append(f">{value.translate(XML_TEXT)}")
+                stack.append((iter(content), f"</{node.name}>"))
+                depth += 1
+                text = bool(node.value)
+            else:
+                out.append("/>")
+                text = False
+        if len(out) >= buffer_size:
+            fp.write("".join(out))
+            out.clear()
+    if root is not None:
+        out.append("" if opened else f"<{xml_name(root)}>")
+        out.append(f"</{root}>")
+    elif not roots:
+        raise ValueError("no root element")
+    fp.write("".join(out))
+
+
+# ////////////////////////////////////////////////////////////////
+# JSON
+
+JSON_STRING = json.encoder.encode_basestring_ascii
+
+
+def source_nodes(source):
+    """Parse AtomicML text or files, pass nodes and node iterables through"""
+    if isinstance(source, (str, io.IOBase)):
+        return parse_node(source)
+    return iter_nodes(source)
+
+
+def json_open(node):
+    """Return JSON for node up to its children"""
+    data = JSON_STRING(node.data)
+    return f'{{"data": {data}, "lineno": {node.lineno}, "children": ['
+
+
+def json_nested(node, out):
+    """Append {"data", "lineno", "children"} JSON for node to out"""
+    out.append(json_open(node))
+    stack = [iter(node.children)]
+    first = True
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+            out.append("]}")
+            first = False
+            continue
+        if not first:
+            out.append(", ")
+        out.append(json_open(child))
+        stack.append(iter(child.children))
+        first = True
+
+
+def json_flat(node, out):
+    """Append [[depth, data, lineno], ...] JSON in preorder for node to out"""
+    out.append("[")
+    stack = [(node, 0)]
+    while stack:
+        node, depth = stack.pop()
+        out.append(f"[{depth}, {JSON_STRING(node.data)}, {node.lineno}]")
+        if stack or node.children:
+            out.append(", ")
+        stack.extend((child, depth + 1) for child in reversed(node.children))
+    out.append("]")
+
+
+def to_ndjson(source, fp, flat=False):
+    """Write one JSON line per top-level node as it is parsed"""
+    encode = json_flat if flat else json_nested
+    for node in source_nodes(source):
+        out = []
+        encode(node, out)
+        out.append("\n")
+        fp.write("".join(out))
+
+
+def from_ndjson(source):
+    """Iterate over JSON lines from to_ndjson and yield nodes"""
+    source = io.StringIO(source) if isinstance(source, str) else source
+    for line in source:
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        if isinstance(item, list):
+            stack = []
+            for depth, data, lineno in item:
+                node = Node(data, 0, lineno)
+                del stack[depth:]
+                if stack:
+                    stack[-1].children.append(node)
+                stack.append(node)
+            yield stack[0]
+            continue
+        root = Node(item["data"], 0, item["lineno"])
+        stack = [(root, item["children"])]
+        while stack:
+            parent, children = stack.pop()
+            for child in children:
+                node = Node(child["data"], 0, child["lineno"])
+                parent.children.append(node)
+                stack.append((node, child["children"]))
+        yield root
@@ -0,0 +1,277 @@
+"""AtomicML Benchmarks
+
+usage:
+    python atomicml_bench.py [name ...]
+
+"""
+
+import copy
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+import atomicml
+
+
+def timed(label, func, *args):
+    """Run func once, print elapsed seconds, return its result"""
+    start = time.perf_counter()
+    result = func(*args)
+    print(f"{label:32} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def make_xml(records=20000):
+    """Generate a large XML document with attributes and long text"""
+    out = ['<?xml version="1.0"?>\n<catalog>\n']
+    for i in range(records):
+        out.append(
+            f'<book id="b{i}" lang="en">\n'
+            f"<title>Title {i}</title>\n"
+            f"<abstract>{'lorem ipsum dolor sit amet &amp; ' * 20}\n"
+            f"second line {i}</abstract>\n</book>\n"
+        )
+    out.append("</catalog>\n")
+    return "".join(out).encode()
+
+
+def bench_xml():
+    """XmlParser (SAX) vs ExpatParser on large XML"""
+    data = make_xml()
+    print(f"xml {len(data) / 1e6:.1f} MB")
+    timed("XmlParser", atomicml.XmlParser().parse, io.BytesIO(data))
+    timed("ExpatParser", atomicml.ExpatParser().parse, io.BytesIO(data))
+
+
+class SplitStyle(atomicml.AtomicStyle):
+    """Dispatch and read values by splitting data on every node"""
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def style(self, children, **kwargs):
+        for node in children:
+            name = node.data.split(None, 1)[0]
+            style = getattr(self, f"{self.pre}{self.map.get(name, name)}", None)
+            if style:
+                style(node, **kwargs)
+            else:
+                self.style(node.children, **kwargs)
+
+    def f_title(self, node):
+        self.count += len(node.children[0].data.split(None, 1)[1])
+
+
+class NameStyle(atomicml.AtomicStyle):
+    """Dispatch and read values with the precomputed name and value"""
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def f_title(self, node):
+        self.count += len(node.children[0].value)
+
+
+def traced(label, func, *args):
+    """Run func once, print elapsed seconds and traced memory it keeps"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{label:32} {elapsed:8.3f}s {size / 1e6:8.1f} MB")
+    return result
+
+
+def bench_names():
+    """Node memory and name dispatch vs data.split() on parsed trees"""
+    data, source = make_xml(), make_atomic()
+    root = traced("ExpatParser tree", atomicml.ExpatParser().parse, io.BytesIO(data))
+    nodes = traced("parse_nodes tree", atomicml.parse_nodes, source)
+    timed("style with data.split", SplitStyle().style, [root])
+    timed("style with node.name", NameStyle().style, [root])
+    timed("parse_nodes untraced", atomicml.parse_nodes, source)
+    return root, nodes
+
+
+def make_atomic(sections=2000, items=50):
+    """Generate a large AtomicML document of sections and items"""
+    out = []
+    for i in range(sections):
+        out.append(f"section Section {i}")
+        out.extend(f"  * item {j} of section {i}" for j in range(items))
+    return "\n".join(out) + "\n"
+
+
+class HtmlStyle(atomicml.AtomicStyle):
+    """Pure, output-returning handlers"""
+
+    def __init__(self, cache=None):
+        super().__init__()
+        self.map["*"] = "li"
+        self.cache = cache
+
+    @atomicml.memoize
+    def f_section(self, node):
+        items = "".join(self.style(node.children))
+        return f"<h2>{node.value}</h2><ul>{items}</ul>"
+
+    def f_li(self, node):
+        return f"<li>{node.value}</li>"
+
+
+def bench_style_cache():
+    """Re-style an unchanged tree with and without StyleCache"""
+    source = make_atomic()
+    style, cached = HtmlStyle(), HtmlStyle(atomicml.StyleCache())
+    timed("style uncached", style.style, atomicml.parse_nodes(source))
+    timed("style cold cache", cached.style, atomicml.parse_nodes(source))
+    nodes = atomicml.parse_nodes(source)
+    timed("subtree_digest alone", lambda: [atomicml.subtree_digest(n) for n in nodes])
+    timed("style warm cache with hashing", cached.style, nodes)
+
+
+def bench_diff(sections=20000):
+    """diff and patch of a million-node tree with a few changes"""
+    source = make_atomic(sections)
+    old = timed("parse old", atomicml.parse_nodes, source)
+    new = atomicml.parse_nodes(source)
+    for i in range(0, sections, sections // 10):
+        new[i].children[i % 50].data = "* changed"
+        new[i].children.append(atomicml.Node("* appended"))
+    del new[sections // 2]
+    print(f"nodes {sum(len(node.children) + 1 for node in old)}")
+    script = timed("diff", atomicml.diff, old, new)
+    timed("diff again", atomicml.diff, old, new)
+    wire = timed("serialize script", str, script)
+    print(f"script {len(wire)} bytes, source {len(source)} bytes")
+    script = timed("parse script", atomicml.parse_nodes, wire)
+    timed("patch", atomicml.patch, old, script)
+    assert not atomicml.diff(old, new).children
+
+
+def as_dict(node):
+    """Nested dicts by recursive walk, the approach to_ndjson replaces"""
+    return {
+        "data": node.data,
+        "lineno": node.lineno,
+        "children": [as_dict(child) for child in node.children],
+    }
+
+
+def dumps_nested(source, fp):
+    for node in atomicml.parse_nodes(source):
+        fp.write(json.dumps(as_dict(node)) + "\n")
+
+
+class Discard:
+    """File-like sink that keeps no output"""
+
+    def write(self, data):
+        return len(data)
+
+
+def bench_ndjson(sections=20000):
+    """to_ndjson nested and flat vs json.dumps of nested dicts"""
+    source, small = make_atomic(sections), make_atomic(sections // 10)
+    for label, func in (
+        ("json.dumps nested dicts", dumps_nested),
+        ("to_ndjson nested", atomicml.to_ndjson),
+        ("to_ndjson flat", lambda source, fp: atomicml.to_ndjson(source, fp, True)),
+    ):
+        fp = io.StringIO()
+        timed(label, func, source, fp)
+        tracemalloc.start()
+        func(small, Discard())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{'':32} {peak / 1e6:8.1f} MB peak at 1/10 size")
+        fp.seek(0)
+        timed("from_ndjson", lambda fp: sum(1 for _ in atomicml.from_ndjson(fp)), fp)
+
+
+def passes_deepcopy(root):
+    """Rename, inject and prune, deep-copying to keep each version"""
+    versions = [root]
+    root = copy.deepcopy(root)
+    for node in walk(root):
+        if node.name == "*":
+            node.data = f"li {node.value}"
+    versions.append(root)
+    root = copy.deepcopy(root)
+    for node in walk(root):
+        if node.name == "section":
+            node.children.insert(0, atomicml.Node("@class section"))
+    versions.append(root)
+    root = copy.deepcopy(root)
+    for node in walk(root):
+        node.children = [child for child in node.children if child.value != "item 7"]
+    versions.append(root)
+    return versions
+
+
+def passes_transform(root):
+    """Rename, inject and prune with transform, sharing subtrees"""
+
+    def rename(node):
+        return node.with_data(f"li {node.value}") if node.name == "*" else node
+
+    def inject(node):
+        if node.name == "section":
+            attr = atomicml.FrozenNode("@class section")
+            return node.with_children((attr,) + node.children)
+        return node
+
+    def prune(node):
+        return None if node.value == "item 7" else node
+
+    versions = [root]
+    for func in (rename, inject, prune):
+        versions.append(atomicml.transform(versions[-1], func))
+    return versions
+
+
+def walk(root):
+    """Iterate over root and its descendants"""
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.children)
+
+
+def bench_frozen(sections=2000):
+    """Multi-pass transforms: deepcopy of Node vs transform of FrozenNode"""
+    root = atomicml.Node("document")
+    root.children = atomicml.parse_nodes(make_atomic(sections))
+    print(f"nodes {sum(1 for _ in walk(root))}")
+    copied = timed("deepcopy passes", passes_deepcopy, root)
+    frozen = timed("freeze", atomicml.freeze, root)
+    shared = timed("transform passes", passes_transform, frozen)
+    timed("thaw", atomicml.thaw, shared[-1])
+    assert str(atomicml.thaw(shared[-1])) == str(copied[-1])
+    section = frozen.children[sections // 2]
+    edit = section.children[0].with_data("* edited")
+    path = (sections // 2, 0)
+    replace = lambda: [frozen.replace(path, edit) for _ in range(1000)]
+    timed("1000 x replace one item", replace)
+
+
+BENCHMARKS = {
+    "xml": bench_xml,
+    "names": bench_names,
+    "style_cache": bench_style_cache,
+    "diff": bench_diff,
+    "ndjson": bench_ndjson,
+    "frozen": bench_frozen,
+}
+
+if __name__ == "__main__":
+    for bench_name in sys.argv[1:] or BENCHMARKS:
+        print(f"//////////////// {bench_name}")
+        BENCHMARKS[bench_name]()
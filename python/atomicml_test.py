@@ -1,8 +1,20 @@
 """AtomicML Test"""
 
+import copy
+import io
+import json
+import pickle
+from xml.dom import minidom
+
+import pytest
+
 from atomicml import Node, Indent, SameDent, Dedent, Blank
 from atomicml import tokenize, parse_node, parse_nodes
-from atomicml import AtomicStyle, XmlParser
+from atomicml import AtomicStyle, XmlParser, ExpatParser
+from atomicml import StyleCache, memoize, subtree_digest
+from atomicml import Schema, diff, patch, write_xml
+from atomicml import to_ndjson, from_ndjson
+from atomicml import FrozenNode, freeze, thaw, transform
 
 # pylint: disable=missing-class-docstring, missing-function-docstring, unused-argument
 
@@ -16,6 +28,16 @@ def test_node():
     node_string = str(node)
     assert node_string == "one\n  two"
 
+def test_node_name():
+    node = Node("@lang \ten  us")
+    assert node.name == "@lang"
+    assert node.value == "en  us"
+    assert node.name is Node("@lang fr").name
+    assert Node().name == "" and Node("one").value == ""
+    node.data = "p q r"
+    assert node.name == "p" and node.value == "q r"
+    assert not hasattr(node, "__dict__")
+
 def test_tokenize():
     """Indent, SameDent, Dedent, Blank"""
     source = "one\n  two\n\n  three\nfour"
@@ -96,17 +118,14 @@ class MyStyleArgs(AtomicStyle):
         self.map["."] = "text"
 
     def f_root(self, node, out):
-        _, value = node.data.split(None, 1)
-        out.append(f"<h1>{value}</h1>")
+        out.append(f"<h1>{node.value}</h1>")
         self.style(node.children, out=out)
 
     def f_li(self, node, out):
-        _, value = node.data.split(None, 1)
-        out.append(f"<li>{value}</li>")
+        out.append(f"<li>{node.value}</li>")
 
     def f_text(self, node, out):
-        _, value = node.data.split(None, 1)
-        out.append(f"<span>{value}</span>")
+        out.append(f"<span>{node.value}</span>")
         self.style(node.children, out=out)
 
 def test_style_node_args():
@@ -122,6 +141,208 @@ def test_style_node_args():
     assert "<li>" in out[3]
     assert "<li>" in out[4]
 
+def test_subtree_digest():
+    one, two = parse_nodes(ATOMIC_SOURCE), parse_nodes(ATOMIC_SOURCE)
+    digests = {}
+    assert subtree_digest(one[0], digests) == subtree_digest(two[0], digests)
+    assert id(one[0].children[0]) in digests
+    assert subtree_digest(Node("ab")) != subtree_digest(parse_nodes("a\n  b")[0])
+    two[0].children[0].children[1] = Node("* changed")
+    assert subtree_digest(two[0]) != subtree_digest(one[0])
+
+class CachedStyle(AtomicStyle):
+    def __init__(self, cache):
+        super().__init__()
+        self.map["*"] = "li"
+        self.map["."] = "text"
+        self.cache = cache
+        self.calls = 0
+
+    @memoize
+    def f_root(self, node, tag="h1"):
+        self.calls += 1
+        return f"<{tag}>{node.value}</{tag}>" + "".join(self.style(node.children))
+
+    @memoize
+    def f_li(self, node, tag="h1"):
+        self.calls += 1
+        return f"<li>{node.value}</li>"
+
+def test_style_memoize(tmp_path):
+    cache = StyleCache(maxsize=2, path=str(tmp_path / "style"))
+    style = CachedStyle(cache)
+    out = style.style(parse_nodes(ATOMIC_SOURCE))
+    assert out == ["<h1>label</h1><li>three</li><li>four</li><li>five</li>"]
+    assert style.calls == 4
+    assert style.style(parse_nodes(ATOMIC_SOURCE)) == out
+    assert style.calls == 4
+    assert style.style(parse_nodes(ATOMIC_SOURCE), tag="h2") != out
+    assert style.calls == 5
+    assert len(cache.memory) == 2
+    cache.close()
+    style = CachedStyle(StyleCache(path=str(tmp_path / "style")))
+    assert style.style(parse_nodes(ATOMIC_SOURCE)) == out
+    assert style.calls == 0
+    assert CachedStyle(None).style(parse_nodes(ATOMIC_SOURCE)) == out
+
+def make_cached_style(cache, tag):
+    class Cached(AtomicStyle):
+        def __init__(self):
+            super().__init__()
+            self.cache = cache
+        if tag == "b":
+            @memoize
+            def f_root(self, node):
+                return f"<b>{node.value}</b>"
+        else:
+            @memoize
+            def f_root(self, node):
+                return f"<i>{node.value}</i>"
+    return Cached()
+
+def test_style_memoize_key():
+    cache = StyleCache()
+    nodes = parse_nodes(ATOMIC_SOURCE)
+    assert CachedStyle(cache).style(nodes)[0].count("<h1>") == 1
+    mapped = CachedStyle(cache)
+    mapped.map["*"] = "root"
+    assert mapped.style(nodes)[0].count("<h1>") == 4
+    bold, italic = make_cached_style(cache, "b"), make_cached_style(cache, "i")
+    assert type(bold).__qualname__ == type(italic).__qualname__
+    assert bold.style(nodes) == ["<b>label</b>"]
+    assert italic.style(nodes) == ["<i>label</i>"]
+
+class ValueStyle(AtomicStyle):
+    def __init__(self):
+        super().__init__()
+        self.cache = StyleCache()
+
+    @memoize
+    def f_p(self, node):
+        return node.value
+
+def test_style_memoize_edit():
+    nodes, style = parse_nodes("p one"), ValueStyle()
+    assert style.style(nodes) == ["one"]
+    nodes[0].data = "p two"
+    assert style.style(nodes) == ["two"]
+    nodes[0].children.append(Node("p three"))
+    assert style.style(nodes) == ["two"]
+    assert len(style.cache.memory) == 3
+    assert style.digests is None
+
+SCHEMA = """\
+root root
+element root
+  child . +
+  attr lang ?
+element .
+  child * *
+element *
+"""
+
+def test_schema():
+    schema = Schema(SCHEMA)
+    assert schema.elements["root"] == {".": (1, None), "@lang": (0, 1)}
+    assert not schema.validate(parse_nodes(ATOMIC_SOURCE))
+    source = "root\n  @lang en\n  @lang fr\n  * stray\n  . one\n    * two\n      x\nother"
+    errors = schema.validate(parse_nodes(source))
+    assert errors == [
+        (8, "unexpected root other"),
+        (4, "unexpected * in root"),
+        (1, "root has 2 @lang"),
+        (7, "unexpected x in *"),
+    ]
+    errors = []
+    nodes = list(schema.parse_node("root\n  @lang en", errors))
+    assert len(nodes) == 1
+    assert errors == [(1, "root missing .")]
+
+def test_schema_errors():
+    for source, lineno in (
+        ("element a\n  child y 2", 2),
+        ("element a\n  attr", 2),
+        ("element a\n  kid y", 2),
+        ("element", 1),
+        ("root a\nelemnt a", 2),
+        ("root a\n  b", 2),
+        ("element a\n  child b\n    junk", 3),
+        ("element a\n  attr b\n\n    junk", 4),
+    ):
+        with pytest.raises(ValueError, match=f"^line {lineno}: bad schema entry"):
+            Schema(source)
+
+def test_schema_xml():
+    schema = Schema("root root\nelement root\n  attr name\n  child ul")
+    assert not schema.validate(ExpatParser().parse(XML_SOURCE))
+    assert not schema.validate(list(parse_node("")))
+    errors = schema.validate(XmlParser().parse("<root><ul/><ul/></root>"))
+    assert errors == [(0, "root missing @name"), (0, "root has 2 ul")]
+
+DIFF_NEW = """\
+root label
+  . two
+    * three
+    * 3.5
+
+    * four
+      ** four-1
+    * five
+  . six
+new
+"""
+
+def test_diff_patch():
+    old, new = parse_nodes(ATOMIC_SOURCE), parse_nodes(DIFF_NEW)
+    script = diff(old, new)
+    assert [op.data for op in script.children] == ["insert 1", "insert 0.1", "insert 0.0.2", "update 0.0.1"]
+    assert str(patch(old, parse_nodes(str(script)))[1]) == "new"
+    assert str(old[0]) == str(new[0])
+    script = diff(parse_nodes(DIFF_NEW), parse_nodes(ATOMIC_SOURCE))
+    assert [op.data for op in script.children] == ["delete 1", "delete 0.1", "delete 0.0.2", "update 0.0.1"]
+    assert str(patch(new, script)[0]) == ATOMIC_SOURCE.rstrip()
+
+def test_diff_update():
+    old, new = parse_nodes("a\n  b\n  c"), parse_nodes("x\n  b\n  y\n    z")
+    script = diff(old[0], new[0])
+    assert str(script) == "!diff\n  update\n    x\n  update 1\n    y\n  insert 1.0\n    z"
+    assert not diff(old, old).children
+    patch(old[0], script)
+    assert str(old[0]) == str(new[0])
+    assert old[0].name == "x"
+    assert not diff(old, new).children
+
+def test_diff_empty_update():
+    old, new = parse_nodes("x"), parse_nodes("")
+    script = diff(old, new)
+    assert str(script) == "!diff\n  update 0"
+    patch(old, parse_nodes(str(script)))
+    assert old[0].data == "" and old[0].name == ""
+    assert not diff(old, new).children
+    old = parse_nodes("a\n  b")
+    patch(old, parse_nodes(str(diff(old, parse_nodes("a\n  c")))))
+    assert str(old[0]) == "a\n  c"
+
+def test_diff_live():
+    old, new = parse_nodes(ATOMIC_SOURCE), parse_nodes(DIFF_NEW)
+    assert diff(old, new).children
+    patch(old, diff(old, new))
+    assert not diff(old, new).children
+    assert old[1] is not new[1] and old[1].data == new[1].data
+    new[0].children[0].children[2].children[0].data = "** changed"
+    new[1].children.append(Node("child"))
+    script = diff(old, new)
+    assert [op.data for op in script.children] == ["update 0.0.2.0", "insert 1.0"]
+    patch(old, script)
+    assert str(old[0]) == str(new[0]) and str(old[1]) == str(new[1])
+
+def test_diff_align():
+    old = parse_nodes("a\nb\nc\nd\ne")
+    new = parse_nodes("a\nx\nc\ne\nf")
+    script = diff(old, new)
+    assert [op.data for op in script.children] == ["delete 3", "insert 4", "update 1"]
+    assert [node.data for node in patch(old, script)] == ["a", "x", "c", "e", "f"]
+
 XML_SOURCE = """\
 <?xml version="1.0"?>
 <root name="zero">
@@ -136,3 +357,200 @@ def test_xml():
     root = XmlParser().parse(XML_SOURCE)
     assert len(root.children) == 1
     print(str(root))
+
+def test_expat():
+    sax = XmlParser().parse(XML_SOURCE)
+    expat = ExpatParser().parse(XML_SOURCE)
+    assert str(expat) == str(sax)
+    expat = ExpatParser().parse(io.BytesIO(XML_SOURCE.encode()))
+    assert str(expat) == str(sax)
+
+class CountingBytesIO(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.sizes = []
+
+    def read(self, size=-1):
+        self.sizes.append(size)
+        return super().read(size)
+
+def test_expat_read_size():
+    source = CountingBytesIO(XML_SOURCE.encode())
+    parser = ExpatParser()
+    parser.buffer_size = 16
+    assert str(parser.parse(source)) == str(XmlParser().parse(XML_SOURCE))
+    assert set(source.sizes) == {16}
+    source = CountingBytesIO(XML_SOURCE.encode())
+    ExpatParser().parse(source)
+    assert source.sizes == [ExpatParser.buffer_size] * 2
+
+def test_expat_text():
+    root = ExpatParser().parse("<r a='1'>one\\\n<!-- c -->two<b/> three </r>")
+    assert str(root) == "!xml\n  r\n    @a 1\n    . one\\\\\\ntwo\n    b\n    . three"
+
+XML_ROUND_TRIP = """\
+<?xml version="1.0"?>
+<!DOCTYPE r [<!NOTATION gif PUBLIC "-//gif" "image/gif"><!ENTITY pic SYSTEM "p.gif" NDATA gif>]>
+<r a="x&#10;\\y" b='"&amp;&lt;'>one
+two\\n<e/>&lt;three&gt; &amp; <f g="1"><h>four</h></f></r>
+"""
+
+def test_write_xml():
+    root = XmlParser().parse(XML_SOURCE)
+    fp = io.StringIO()
+    write_xml(root, fp)
+    assert str(XmlParser().parse(fp.getvalue())) == str(root)
+    root = ExpatParser().parse(XML_ROUND_TRIP)
+    fp = io.StringIO()
+    write_xml(root, fp, buffer_size=2)
+    assert str(ExpatParser().parse(fp.getvalue())) == str(root)
+    assert '<!DOCTYPE r [<!NOTATION gif PUBLIC "-//gif" "image/gif">' in fp.getvalue()
+
+def test_write_xml_stream():
+    source = "a x\n  @k v\\n\n  . 1 < 2\n  b\n!skip\nc"
+    fp = io.StringIO()
+    write_xml(parse_node(source), fp, declaration=False, root="doc")
+    assert fp.getvalue() == '<doc><a k="v&#10;">x\n1 &lt; 2<b/></a><c/></doc>'
+    minidom.parseString(fp.getvalue())
+    with pytest.raises(ValueError, match="line 6: second root c"):
+        write_xml(parse_node(source), io.StringIO())
+    with pytest.raises(ValueError, match="line 3: invalid XML name '[*]'"):
+        write_xml(parse_node("root label\n  . two\n    * three"), io.StringIO())
+    with pytest.raises(ValueError, match="invalid XML name '1a'"):
+        write_xml(parse_node("r\n  @1a v"), io.StringIO())
+    with pytest.raises(ValueError, match="duplicate @k"):
+        write_xml(parse_node("r\n  @k v\n  @k w"), io.StringIO())
+    with pytest.raises(ValueError, match="text outside"):
+        write_xml(parse_node(". loose"), io.StringIO())
+
+def test_write_xml_chars():
+    for source, lineno in (
+        ("r\n  . a\x01b", 2),
+        ("r\n  @k a\x1fb", 2),
+        ("r\n\n  b \ufffe", 3),
+        ("!xml\n  !notation n\n    @system \x00\nr", 2),
+    ):
+        with pytest.raises(ValueError, match=f"^line {lineno}: invalid XML character"):
+            write_xml(parse_node(source), io.StringIO())
+    root = Node("r a\rb")
+    root.children.append(Node("@k v\rw"))
+    fp = io.StringIO()
+    write_xml(root, fp)
+    assert fp.getvalue().endswith('<r k="v&#13;w">a&#13;b</r>')
+    parsed = ExpatParser().parse(fp.getvalue()).children[0]
+    assert parsed.children[0].value == "v\rw" and parsed.children[1].value == "a\rb"
+
+def test_write_xml_file(tmp_path):
+    path = tmp_path / "in.xml"
+    path.write_text("<r>hi\nthere <b/>one\ntwo\nthree</r>\n")
+    with open(path, encoding="utf-8") as source:
+        root = XmlParser().parse(source)
+    assert [child.data for child in root.children[0].children][:2] == [". hi", ". there"]
+    with open(tmp_path / "out.xml", "w", encoding="utf-8") as fp:
+        write_xml(root, fp)
+    with open(tmp_path / "out.xml", encoding="utf-8") as source:
+        assert str(XmlParser().parse(source)) == str(root)
+
+def test_write_xml_doctype():
+    root = ExpatParser().parse(
+        """<!DOCTYPE r [<!NOTATION n PUBLIC "c'd" 'a"b'>]><r/>"""
+    )
+    fp = io.StringIO()
+    write_xml(root, fp)
+    assert """<!NOTATION n PUBLIC "c'd" 'a"b'>""" in fp.getvalue()
+    assert str(ExpatParser().parse(fp.getvalue())) == str(root)
+    fp = io.StringIO()
+    write_xml([root, ExpatParser().parse("<r/>")], fp, root="doc")
+    assert '<!DOCTYPE doc [<!NOTATION n PUBLIC "c\'d" \'a"b\'>]>\n<doc><r/><r/></doc>' in fp.getvalue()
+    with pytest.raises(ValueError, match="DOCTYPE after root"):
+        write_xml([root, root], io.StringIO(), root="doc")
+    root.children[0].children[1].data = "@system a\"b'c"
+    with pytest.raises(ValueError, match="both quotes"):
+        write_xml(root, io.StringIO())
+    root.children[0].children[0].data = '@public a"b'
+    with pytest.raises(ValueError, match="public ID"):
+        write_xml(root, io.StringIO())
+
+
+def as_dict(node):
+    return {
+        "data": node.data,
+        "lineno": node.lineno,
+        "children": [as_dict(child) for child in node.children],
+    }
+
+def test_ndjson():
+    source = ATOMIC_SOURCE + 'next "quoted" \u00e9\n  \\ tab\there\nlast\n'
+    nodes = parse_nodes(source)
+    fp = io.StringIO()
+    to_ndjson(source, fp)
+    lines = fp.getvalue().splitlines()
+    assert lines == [json.dumps(as_dict(node)) for node in nodes]
+    assert [str(node) for node in from_ndjson(fp.getvalue())] == [str(node) for node in nodes]
+    fp = io.StringIO()
+    to_ndjson(nodes, fp, flat=True)
+    lines = fp.getvalue().splitlines()
+    assert json.loads(lines[0])[:2] == [[0, "root label", 1], [1, ". two", 2]]
+    assert json.loads(lines[2]) == [[0, "last", 8]]
+    rebuilt = list(from_ndjson(io.StringIO(fp.getvalue())))
+    assert [as_dict(node) for node in rebuilt] == [as_dict(node) for node in nodes]
+
+def test_frozen_node():
+    node = parse_nodes(ATOMIC_SOURCE)[0]
+    tree = freeze(node)
+    assert isinstance(tree.children, tuple)
+    assert tree.name == "root" and tree.value == "label"
+    assert str(tree) == str(node) == str(thaw(tree))
+    renamed = tree.with_data("page label")
+    assert renamed.children is tree.children
+    items = tree.children[0].children
+    removed = tree.replace((0, 1), None)
+    assert [child.data for child in removed.children[0].children] == ["* three", "* five"]
+    assert removed.children[0].children[0] is items[0]
+    assert tree.replace((0, 1), FrozenNode("* 4")).children[0].children[2] is items[2]
+    assert tree.replace((), renamed) is renamed
+
+def test_transform():
+    tree = freeze(parse_nodes(ATOMIC_SOURCE + "  . untouched\n    x y\n")[0])
+    def rename(node):
+        return node.with_data(f"li {node.value}") if node.name == "*" else node
+    def prune(node):
+        return None if node.data == "li four" else node
+    def inject(node):
+        if node.name == "li":
+            return node.with_children((FrozenNode("@class item"),) + node.children)
+        return node
+    new = transform(transform(transform(tree, rename), prune), inject)
+    assert "li " not in str(tree)
+    assert new.children[1] is tree.children[1]
+    assert [child.data for child in new.children[0].children] == ["li three", "li five"]
+    assert new.children[0].children[0].children[0].data == "@class item"
+    assert transform(tree, lambda node: node) is tree
+    assert transform(tree, lambda node: None if node.name == "root" else node) is None
+    style = MyStyleArgs()
+    out = []
+    style.style(tree, out=out)
+    assert len(out) == 6
+    assert out[:3] == ["<h1>label</h1>", "<span>two</span>", "<li>three</li>"]
+
+def test_frozen_node_copy():
+    tree = freeze(parse_nodes(ATOMIC_SOURCE)[0])
+    for clone in (
+        copy.copy(tree),
+        copy.deepcopy(tree),
+        pickle.loads(pickle.dumps(tree)),
+        pickle.loads(pickle.dumps(tree, 0)),
+    ):
+        assert clone == tree and str(clone) == str(tree)
+        assert isinstance(clone, FrozenNode) and clone.value == "label"
+    renamed = tree._replace(data="zzz q")
+    assert renamed.name == "zzz" and renamed.value == "q"
+    assert renamed.children is tree.children
+    assert FrozenNode._make(["a b", "x", 0, 0, ()]).name == "a"
+    with pytest.raises(ValueError):
+        tree._replace(name="x")
+
+def test_frozen_style_cache():
+    tree = freeze(parse_nodes(ATOMIC_SOURCE)[0])
+    style = CachedStyle(StyleCache())
+    assert style.style(tree) == style.style(parse_nodes(ATOMIC_SOURCE))
@@ -3,8 +3,11 @@ sliml.py - new SliML parser for Python
 
 usage:
     import sliml
-    # 0 is start state that expects title
-    html = sliml.SliML().getHtml(0, slimlData)
+    html = sliml.SliML().render(slimlData)
+
+A SliML instance holds only the compiled grammar, shared by every
+instance of the class. Each parse or render call runs on its own
+copy, so one instance may be used from many threads at once.
 
 author: Neill A. Kipp
 created: March 15, 2004
@@ -15,6 +18,7 @@ modified: Sept 22, 2023 - NK - refactor and upgrade to python3
 
 """
 
+import copy
 import re
 import io
 import atomicml
@@ -211,22 +215,28 @@ state slideHead
   table emptySlideHead tableHead
 """
 
+    compiled = {}
+
     def __init__(self):
         super().__init__()
-        self.tokens = []
-        self.states = {}
-        self.style(atomicml.parse_nodes(self.grammar))
+        compiled = self.compiled.get((self.__class__, self.grammar))
+        if compiled is None:
+            self.tokens = []
+            self.states = {}
+            self.style(atomicml.parse_nodes(self.grammar))
+            compiled = (tuple(self.tokens), self.states)
+            self.compiled[(self.__class__, self.grammar)] = compiled
+        self.tokens, self.states = compiled
         self.stack = []
         self.inColumns = 0
         self.holdLine = ""
 
     def f_tokens(self, node):
         for child in node.children:
-            token_name, pattern = child.data.split(None, 1)
-            self.tokens.append(Token(token_name, re.compile(pattern)))
+            self.tokens.append(Token(child.name, re.compile(child.value)))
 
     def f_state(self, node):
-        state_name = node.data.split(None, 1)[1]
+        state_name = node.value
         state = self.states[state_name] = State(state_name)
         for child in node.children:
             fields = child.data.split()
@@ -244,8 +254,20 @@ state slideHead
         return "\n".join(out)
 
     def parse(self, source, out):
+        """Append HTML lines for source to out, using per-call state"""
+        copy.copy(self).run(source, out)
+
+    def render(self, source):
+        """Return HTML for source"""
+        out = []
+        self.parse(source, out)
+        return "\n".join(out)
+
+    def run(self, source, out):
         source = io.StringIO(source) if isinstance(source, str) else source
         self.stack = [-1]
+        self.inColumns = 0
+        self.holdLine = ""
         state = self.states["start"]
         for line in source:
             for token in self.tokens:
@@ -411,8 +433,5 @@ state slideHead
 if __name__ == "__main__":
     import sys
 
-    html = []
-    source = open(sys.argv[-1], encoding="utf-8")
-    SliML().parse(source, html)
-    for line in html:
-        print(line)
+    with open(sys.argv[-1], encoding="utf-8") as source:
+        print(SliML().render(source))
@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import sliml
 
 source = """\
@@ -67,3 +69,20 @@ def test_sliml():
     s = sliml.SliML()
     s.parse(source, out)
     print("\n".join(out))
+
+
+def test_sliml_reuse():
+    s = sliml.SliML()
+    first = s.render(source)
+    assert s.render(source) == first
+    assert sliml.SliML().tokens is s.tokens
+    s.render("<col>\nH1\nheld line")
+    assert s.render(source) == first
+
+
+def test_sliml_threads():
+    s = sliml.SliML()
+    decks = [source.replace("Head", f"Head {i}") for i in range(200)]
+    serial = [s.render(deck) for deck in decks]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        assert list(pool.map(s.render, decks)) == serial